@@ -1,87 +1,578 @@
 import os
-import json
 import sys
+import logging
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from github import Github, GithubException, GithubObject
 from github.Milestone import Milestone # Milestoneクラスを明示的にインポート
-import subprocess
+import re
+import string
+import hashlib
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
 import time # timeモジュールをインポート
 from typing import Optional # Optionalをインポート
 
+# --- ログ設定 ---
+# LOG_LEVEL=DEBUG を指定した場合のみデバッグログを出力する (既定はINFO)
+# logger.debug は出力されないレベルでは文字列のフォーマット自体を行わない
+# ルートロガーはINFOのままにし、urllib3等のライブラリのデバッグログ (リクエストURLを含む) は出さない
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(levelname)s: %(message)s',
+    stream=sys.stdout # GitHub Actionsのログでこれまでの出力と同じ場所に出す
+)
+logger = logging.getLogger(__name__)
+LOG_LEVEL = (os.getenv('LOG_LEVEL') or 'INFO').upper()
+if isinstance(logging.getLevelName(LOG_LEVEL), int):
+    logger.setLevel(LOG_LEVEL)
+else:
+    logger.setLevel(logging.INFO)
+    logger.warning("Unknown LOG_LEVEL '%s'. Falling back to INFO.", LOG_LEVEL)
+
 # --- 環境変数の読み込み ---
 # GitHub Actionsから渡される環境変数
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
-GITHUB_ORG_NAME = os.getenv('GITHUB_ORG_NAME')
-FRONTEND_REPO_NAME = os.getenv('FRONTEND_REPO_NAME')
-BACKEND_REPO_NAME = os.getenv('BACKEND_REPO_NAME')
-GITHUB_PROJECT_NAME = os.getenv('GITHUB_PROJECT_NAME')
-
-# デバッグ用: 環境変数が設定されているか確認
-if not all([GEMINI_API_KEY, GITHUB_TOKEN, GITHUB_ORG_NAME, FRONTEND_REPO_NAME, BACKEND_REPO_NAME, GITHUB_PROJECT_NAME]):
-    print("Error: One or more required environment variables are not set.")
+REQUIRED_ENV_VARS = (
+    'GEMINI_API_KEY',
+    'GITHUB_TOKEN',
+    'GITHUB_ORG_NAME',
+    'FRONTEND_REPO_NAME',
+    'BACKEND_REPO_NAME',
+    'GITHUB_PROJECT_NAME',
+)
+
+# 環境変数が設定されているか確認し、足りないものは名前を表示する
+missing_env_vars = [name for name in REQUIRED_ENV_VARS if not os.environ.get(name)]
+if missing_env_vars:
+    logger.error("Required environment variables are not set: %s", ', '.join(missing_env_vars))
     sys.exit(1)
 
+GEMINI_API_KEY = os.environ['GEMINI_API_KEY']
+GITHUB_TOKEN = os.environ['GITHUB_TOKEN']
+GITHUB_ORG_NAME = os.environ['GITHUB_ORG_NAME']
+FRONTEND_REPO_NAME = os.environ['FRONTEND_REPO_NAME']
+BACKEND_REPO_NAME = os.environ['BACKEND_REPO_NAME']
+GITHUB_PROJECT_NAME = os.environ['GITHUB_PROJECT_NAME']
+
 # --- GitHub APIクライアントの初期化 ---
-try:
-    g = Github(GITHUB_TOKEN)
-    org = g.get_organization(GITHUB_ORG_NAME)
-    frontend_repo = org.get_repo(FRONTEND_REPO_NAME)
-    backend_repo = org.get_repo(BACKEND_REPO_NAME)
-
-    # ターゲットリポジリのマッピング
-    REPO_MAP = {
-        "frontend": frontend_repo,
-        "backend": backend_repo,
-    }
-except GithubException as e:
-    print(f"Error initializing GitHub client or getting organization/repos: {e}")
-    sys.exit(1)
+class LazyRepoMap:
+    """
+    リポジリキーからPyGithubのRepositoryオブジェクトを引くマッピング。
+    リポジリは最初にアクセスされたときに取得するため、LLMの出力で使われないリポジリへのAPI呼び出しは発生しない。
+    """
+    def __init__(self, github_client, owner: str, repo_names: dict):
+        self._github_client = github_client
+        self._owner = owner
+        self._repo_names = repo_names
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, repo_key) -> bool:
+        return repo_key in self._repo_names
+
+    def __getitem__(self, repo_key):
+        # 現状はジョブを組み立てるメインスレッドからしか呼ばれないが、将来ワーカーから呼ばれても二重に取得しないようロックする
+        with self._lock:
+            if repo_key not in self._cache:
+                full_name = f"{self._owner}/{self._repo_names[repo_key]}"
+                try:
+                    self._cache[repo_key] = self._github_client.get_repo(full_name)
+                except GithubException as e:
+                    logger.error("Error getting repository '%s': %s", full_name, e)
+                    sys.exit(1)
+            return self._cache[repo_key]
+
+g = Github(GITHUB_TOKEN)
+
+# ターゲットリポジリのマッピング
+REPO_NAMES = {
+    "frontend": FRONTEND_REPO_NAME,
+    "backend": BACKEND_REPO_NAME,
+}
+REPO_MAP = LazyRepoMap(g, GITHUB_ORG_NAME, REPO_NAMES)
+
+# --- HTTPセッション ---
+# Gemini APIとGitHub GraphQL APIへの接続はこのセッションで使い回し、リクエストごとのTCP/TLSハンドシェイクを省く
+# (ホストごとに最大10本の接続をプールする。リトライは呼び出し側で行うため、アダプターには設定しない)
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=10))
+
+# --- GitHub GraphQL APIの設定 ---
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+GITHUB_GRAPHQL_TIMEOUT = (5, 30)
+# レート制限 (403/429) や一時的なエラー時のリトライ設定
+GITHUB_MAX_RETRIES = 4
+GITHUB_BACKOFF_BASE_SECONDS = 2
+GITHUB_RETRY_STATUS_CODES = (403, 429, 502, 503, 504)
+# マイルストーン/Issue作成を並行に実行するスレッド数と、同時に実行する書き込みリクエスト数の上限
+# (GitHubのセカンダリレート制限に引っかからないよう、書き込みはスレッド数より絞る)
+GITHUB_MAX_WORKERS = 8
+GITHUB_MAX_CONCURRENT_WRITES = 4
+github_write_semaphore = threading.Semaphore(GITHUB_MAX_CONCURRENT_WRITES)
+# 1回のGraphQLリクエストにまとめるProject追加ミューテーションの数
+GITHUB_PROJECT_LINK_BATCH_SIZE = 20
+
+# 優先順位ラベル名 (プロンプトで指定している値の分だけ事前に作っておき、それ以外はその場で組み立てる)
+PRIORITY_LABELS = {priority: f"priority:{priority}" for priority in ('HIGH', 'MEDIUM', 'LOW', 'high', 'medium', 'low')}
+# 既存アイテムの事前取得で問い合わせる接続 ({cursor_var} にはページネーション用の変数名が入る)
+REPO_ITEM_CONNECTIONS = {
+    'milestones': "milestones(first: 100, after: ${cursor_var}) {{ nodes {{ title number }} pageInfo {{ hasNextPage endCursor }} }}",
+    'issues': "issues(first: 100, after: ${cursor_var}, states: OPEN) {{ nodes {{ id title milestone {{ title }} projectItems(first: 20) {{ nodes {{ project {{ id }} }} }} }} pageInfo {{ hasNextPage endCursor }} }}",
+}
+
+# --- LLM呼び出しの設定 ---
+GEMINI_MODEL = "gemini-2.0-flash"
+# 要件定義がこの文字数を超える場合、見出し単位で分割して並行にLLMへ渡す
+REQUIREMENTS_CHUNK_CHARS = 8000
+# Gemini APIへの同時リクエスト数の上限
+GEMINI_MAX_CONCURRENCY = 4
+# (接続タイムアウト, 読み込みタイムアウト) 秒。ハングした呼び出しはリトライに回す
+# ストリーミングでは読み込みタイムアウトは生成全体ではなく、チャンク間の待ち時間に適用される
+GEMINI_TIMEOUT = (5, 30)
+GEMINI_MAX_RETRIES = 3
+GEMINI_BACKOFF_BASE_SECONDS = 2
+GEMINI_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+GEMINI_MAX_OUTPUT_TOKENS = 8192
+
+# LLMの出力形式 (Gemini APIのresponseSchema)。プロンプトで説明しているフォーマットと一致させること
+GEMINI_RESPONSE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'milestones': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'name': {'type': 'STRING'},
+                    'description': {'type': 'STRING'},
+                    'target_repositories': {
+                        'type': 'ARRAY',
+                        'items': {'type': 'STRING', 'enum': ['frontend', 'backend']}
+                    },
+                    'due_on': {'type': 'STRING'}
+                },
+                'required': ['name', 'target_repositories']
+            }
+        },
+        'tasks': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'title': {'type': 'STRING'},
+                    'description': {'type': 'STRING'},
+                    'target_repository': {'type': 'STRING', 'enum': ['frontend', 'backend']},
+                    'assignee_candidate': {'type': 'STRING', 'enum': ['frontend', 'backend']},
+                    'priority': {'type': 'STRING'},
+                    'milestone_name': {'type': 'STRING'},
+                    'status': {'type': 'STRING'}
+                },
+                'required': ['title', 'target_repository', 'milestone_name']
+            }
+        }
+    },
+    'required': ['milestones', 'tasks']
+}
+
+# Geminiの応答をリクエスト内容のハッシュをキーにキャッシュするディレクトリと有効期限 (秒)
+GEMINI_CACHE_DIR = Path('.cache/gemini')
+GEMINI_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
 
 # --- LLM API呼び出し関数 ---
-def call_gemini_api(prompt_text: str) -> dict:
+def load_cached_gemini_response(cache_path: Path) -> Optional[dict]:
     """
-    Gemini Pro APIを呼び出し、構造化されたJSONデータを取得する。
+    キャッシュ済みのGeminiの応答を読み込む。存在しない、期限切れ、または壊れている (JSONオブジェクトでない) 場合はNoneを返す。
     """
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
-    headers = {'Content-Type': 'application/json'}
+    try:
+        if time.time() - cache_path.stat().st_mtime > GEMINI_CACHE_TTL_SECONDS:
+            return None
+        cached_response = orjson.loads(cache_path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    return cached_response if isinstance(cached_response, dict) else None
+
+def prune_gemini_response_cache():
+    """
+    有効期限の切れたキャッシュファイルを削除する。
+    GitHub Actionsのキャッシュは前回の内容を引き継ぐため、削除しないとディレクトリが際限なく大きくなる。
+    """
+    if not GEMINI_CACHE_DIR.is_dir():
+        return
+    expired_before = time.time() - GEMINI_CACHE_TTL_SECONDS
+    for cache_path in GEMINI_CACHE_DIR.iterdir():
+        try:
+            if cache_path.stat().st_mtime < expired_before:
+                cache_path.unlink()
+                logger.debug("Removed expired Gemini response cache: %s", cache_path)
+        except OSError as e:
+            logger.warning("Failed to remove expired Gemini response cache %s: %s", cache_path, e)
+
+def save_gemini_response_cache(cache_path: Path, generated_json_string: str):
+    """
+    Geminiの応答をキャッシュに書き込む。書き込みに失敗しても処理は続行する。
+    """
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # 並行に書き込まれても壊れたファイルを読まないよう、一時ファイル経由で置き換える
+        tmp_path = cache_path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_text(generated_json_string, encoding='utf-8')
+        tmp_path.replace(cache_path)
+    except OSError as e:
+        logger.warning("Failed to write Gemini response cache %s: %s", cache_path, e)
+
+def call_gemini_api(requirements_content: str) -> dict:
+    """
+    要件定義 (またはその一部) からプロンプトを作成してGemini Pro APIをストリーミング (SSE) で呼び出し、構造化されたJSONデータを取得する。
+    生成されたテキストは届いた順に連結し、最後に一度だけJSONとしてパースする。
+    同じモデル・プロンプトテンプレート・要件定義・生成設定の応答がキャッシュにあればAPIを呼び出さずにそれを返す。
+    タイムアウトや一時的なエラー (429, 5xx) の場合は指数バックオフでリトライする。
+    """
+    # APIキーはURLに含めずヘッダーで渡し、ログや例外メッセージに出るURLから漏れないようにする
+    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse"
+    headers = {'Content-Type': 'application/json', 'x-goog-api-key': GEMINI_API_KEY}
     payload = {
-        'contents': [{'parts': [{'text': prompt_text}]}],
+        'contents': [{'parts': [{'text': build_prompt(requirements_content)}]}],
         'generationConfig': {
-            'responseMimeType': 'application/json' # JSON形式で出力することを強制
+            'responseMimeType': 'application/json', # JSON形式で出力することを強制
+            'responseSchema': GEMINI_RESPONSE_SCHEMA, # 出力の構造もスキーマで強制
+            'maxOutputTokens': GEMINI_MAX_OUTPUT_TOKENS # 出力が際限なく長くなるのを防ぐ
         }
     }
 
-    print("Calling Gemini API...")
-    try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=300) # タイムアウトを長めに設定
-        response.raise_for_status() # HTTPエラーをチェック (4xx, 5xx)
+    # 要件定義だけでなくモデル・テンプレート・生成設定 (スキーマ等) が変わった場合もキャッシュを使わないよう、これらをキーに含める
+    # 展開後のプロンプトは実行日 ($today) を含み日ごとに変わるため、キーには使わない
+    cache_key_source = orjson.dumps({
+        'model': GEMINI_MODEL,
+        'template': PROMPT_TEMPLATE.template,
+        'requirements': requirements_content,
+        'generationConfig': payload['generationConfig'],
+    }, option=orjson.OPT_SORT_KEYS)
+    cache_path = GEMINI_CACHE_DIR / f"{hashlib.sha256(cache_key_source).hexdigest()}.json"
+    cached_response = load_cached_gemini_response(cache_path)
+    if cached_response is not None:
+        logger.info("Using cached Gemini response: %s", cache_path)
+        return cached_response
+
+    for attempt in range(1, GEMINI_MAX_RETRIES + 1):
+        logger.info("Calling Gemini API... (attempt %s/%s)", attempt, GEMINI_MAX_RETRIES)
+        generated_text_parts = []
+        try:
+            with http_session.post(api_url, headers=headers, data=orjson.dumps(payload), timeout=GEMINI_TIMEOUT, stream=True) as response:
+                if response.status_code in GEMINI_RETRY_STATUS_CODES and attempt < GEMINI_MAX_RETRIES:
+                    wait_seconds = GEMINI_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1))
+                    logger.warning("Gemini API returned %s. Retrying in %ss...", response.status_code, wait_seconds)
+                    time.sleep(wait_seconds)
+                    continue
+                response.raise_for_status() # HTTPエラーをチェック (4xx, 5xx)
+
+                # SSEの各イベント (`data:` 行) に含まれる生成テキストの断片を、届いた順に集める
+                for line in response.iter_lines():
+                    if not line.startswith(b'data:'):
+                        continue
+                    event = orjson.loads(line[len(b'data:'):])
+                    for candidate in event.get('candidates', [])[:1]:
+                        for part in candidate.get('content', {}).get('parts', []):
+                            generated_text_parts.append(part.get('text', ''))
+
+            # LLMの出力はJSON文字列として返されるため、連結してからパース
+            generated_json_string = ''.join(generated_text_parts)
+            logger.debug("Raw LLM Response JSON String: %s", generated_json_string)
+            llm_output = orjson.loads(generated_json_string) # JSON文字列をPython辞書に変換
+            save_gemini_response_cache(cache_path, generated_json_string)
+            return llm_output
+
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt < GEMINI_MAX_RETRIES:
+                wait_seconds = GEMINI_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1))
+                logger.warning("Gemini API call failed (%s). Retrying in %ss...", e, wait_seconds)
+                time.sleep(wait_seconds)
+                continue
+            logger.error("Error calling Gemini API: %s", e)
+            sys.exit(1)
+        except requests.exceptions.RequestException as e:
+            logger.error("Error calling Gemini API: %s", e)
+            sys.exit(1)
+        except (KeyError, IndexError, orjson.JSONDecodeError) as e:
+            logger.error("Error parsing LLM response or unexpected format: %s", e)
+            logger.error("LLM raw response: %s", ''.join(generated_text_parts) or 'No response')
+            sys.exit(1)
+        except Exception as e:
+            logger.error("An unexpected error occurred during LLM call: %s", e)
+            sys.exit(1)
+
+def call_gemini_api_batch(requirement_chunks: list) -> dict:
+    """
+    要件定義のチャンクごとにGemini APIを並行に呼び出し、返ってきたマイルストーンとタスクをマージする。
+    同名のマイルストーンは1つにまとめ、`target_repositories` は順序を保った和集合とし、
+    `description` と `due_on` は最初のものが空の場合に後のもので補う。
+    """
+    # 各チャンクの呼び出しでキャッシュを読む前に、期限切れのファイルを一度だけ掃除する
+    prune_gemini_response_cache()
+
+    if len(requirement_chunks) == 1:
+        results = [call_gemini_api(requirement_chunks[0])]
+    else:
+        logger.info("Calling Gemini API for %s requirement chunks concurrently...", len(requirement_chunks))
+        with ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY) as executor:
+            results = list(executor.map(call_gemini_api, requirement_chunks))
+
+    # マージする前に各チャンクの出力の形を確認し、不正な出力はトレースバックではなくエラーログで終了させる
+    for result in results:
+        if not isinstance(result, dict):
+            logger.error("Unexpected LLM output format: expected a JSON object, got %s", type(result).__name__)
+            sys.exit(1)
+        for field in ('milestones', 'tasks'):
+            if not isinstance(result.get(field) or [], list):
+                logger.error("Unexpected LLM output format: '%s' must be a list, got %s", field, type(result[field]).__name__)
+                sys.exit(1)
 
-        result = response.json()
+    merged = {'milestones': [], 'tasks': []}
+    milestones_by_name = {}
+    for result in results:
+        for m_data in result.get('milestones') or []:
+            m_name = m_data.get('name') if isinstance(m_data, dict) else None
+            if not isinstance(m_name, str) or m_name not in milestones_by_name:
+                if isinstance(m_name, str) and m_name:
+                    m_data = dict(m_data) # チャンクの結果を書き換えないようコピーしてからマージ先にする
+                    milestones_by_name[m_name] = m_data
+                merged['milestones'].append(m_data)
+                continue
+
+            # 別のチャンクが返した同名のマイルストーンを、最初に現れたものにマージする
+            logger.debug("Merging duplicate milestone '%s' returned by another chunk.", m_name)
+            existing = milestones_by_name[m_name]
+            existing_repos = existing.get('target_repositories')
+            new_repos = m_data.get('target_repositories')
+            if isinstance(existing_repos, list) and isinstance(new_repos, list):
+                # 検証前の値のため、ハッシュ不能な要素が混ざっていても壊れないようリストの包含判定で和集合を取る
+                existing['target_repositories'] = existing_repos + [repo for repo in new_repos if repo not in existing_repos]
+            elif not isinstance(existing_repos, list) and isinstance(new_repos, list):
+                existing['target_repositories'] = new_repos
+            for field in ('description', 'due_on'):
+                if not existing.get(field) and m_data.get(field):
+                    existing[field] = m_data[field]
+        merged['tasks'].extend(result.get('tasks') or [])
+    return merged
+
+# --- プロンプト作成関数 ---
+# LLMへのプロンプトのテンプレート ($today と $requirements を置換する)
+# string.Template を使うため、JSONフォーマット例の波括弧はエスケープ不要
+PROMPT_TEMPLATE = string.Template("""
+    以下の要件定義ドキュメントから、主要なマイルストーン（目標）と、**それに付随する詳細なタスク（Issue）**をJSON形式で抽出してください。
 
-        # LLMの出力はJSON文字列として返されるため、それをパース
-        generated_json_string = result['candidates'][0]['content']['parts'][0]['text']
-        print(f"Raw LLM Response JSON String: {generated_json_string}")
-        return json.loads(generated_json_string) # JSON文字列をPython辞書に変換
+    - **マイルストーン**は以下のフィールドを持つものとします。
+      - `name`: マイルストーンのタイトル (文字列, 必須)
+      - `description`: マイルストーンの説明 (文字列, オプション)
+      - `target_repositories`: このマイルストーンが関連するリポジリのリスト (例: `["frontend", "backend"]`, **必ず1つ以上のリポジリを含めてください**)
+      - `due_on`: マイルストーンの期限 (YYYY-MM-DD形式の文字列, オプション, ただし、2025-06-13 ~ 2025-06-22の10-DAYハッカソンとする。 )
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling Gemini API: {e}")
-        sys.exit(1)
-    except (KeyError, IndexError, json.JSONDecodeError) as e:
-        print(f"Error parsing LLM response or unexpected format: {e}")
-        print(f"LLM raw response: {response.text if 'response' in locals() else 'No response'}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"An unexpected error occurred during LLM call: {e}")
-        sys.exit(1)
+    - **タスク**は以下のフィールドを持つものとします。
+      - `title`: Issueのタイトル (文字列, 必須)
+      - `description`: Issueの説明 (文字列, オプション)。**タスクの完了条件や影響範囲など、具体的で実行可能な内容を記述してください。**
+      - `target_repository`: このタスクが属するリポジリ ('frontend' または 'backend')
+      - `assignee_candidate`: 担当者候補 ('frontend' または 'backend')
+      - `priority`: タスクの優先順位 ('HIGH', 'MEDIUM', 'LOW' のいずれか, オプション)
+      - `milestone_name`: このタスクを紐付けるマイルストーンの`name` (文字列, **マイルストーンに紐づく場合は必ずそのマイルストーンの`name`と完全に一致させ、紐づかない場合は空文字列 `""` を指定してください**)
+      - `status`: タスクの進行状況 ('Todo' (デフォルト))
+
+    **要求事項:**
+    - マイルストーンを生成する場合、**必ずそのマイルストーンに関連する具体的なタスク（Issue）を複数生成してください。**
+    - タスクは、マイルストーンに紐づかない独立したものでも構いません。
+    - 生成するJSONは、指定されたフォーマットに厳密に従ってください。
+    - **マイルストーンに関連するタスクには、必ず該当するマイルストーンの`name`を`milestone_name`フィールドに正確に記述してください。**
+
+    **JSONフォーマット例:**
+    ```json
+    {
+      "milestones": [
+        {
+          "name": "GitHub OAuth 実装完了",
+          "description": "ユーザーがGitHubアカウントでログインし、Supabaseと連携できる状態",
+          "target_repositories": ["frontend", "backend"],
+          "due_on": "$today"
+        }
+      ],
+      "tasks": [
+        {
+          "title": "バックエンド: GitHub OAuth コールバック処理実装",
+          "description": "GitHubから受け取った認証コードをSupabaseに渡し、セッションを作成。完了条件：ユーザーセッションが正常に確立されること。参考：Supabase Auth ドキュメント。",
+          "target_repository": "backend",
+          "assignee_candidate": "backend",
+          "priority": "high",
+          "milestone_name": "GitHub OAuth 実装完了",
+          "status": "Todo"
+        },
+        {
+          "title": "フロントエンド: ログインUIと認証フロー実装",
+          "description": "ログインボタンからGitHub OAuth を呼び出し、認証後のリダイレクトを処理。完了条件：ログインボタンが表示され、クリックでGitHub認証が開始されること。",
+          "target_repository": "frontend",
+          "assignee_candidate": "frontend",
+          "priority": "high",
+          "milestone_name": "GitHub OAuth 実装完了",
+          "status": "Todo"
+        },
+        {
+          "title": "READMEを整備",
+          "description": "プロジェクトの基本的な情報、目的、コンセプトを記述する",
+          "target_repository": "frontend",
+          "assignee_candidate": "frontend",
+          "priority": "medium",
+          "milestone_name": "",
+          "status": "Todo"
+        },
+        {
+          "title": "バックエンド: 草データ取得API実装",
+          "description": "GitHub API を利用してユーザーのContributionデータを取得し、DBに保存するAPIを実装。影響範囲：デッキ編成画面、ユーザーデータ。",
+          "target_repository": "backend",
+          "assignee_candidate": "backend",
+          "priority": "medium",
+          "milestone_name": "",
+          "status": "Todo"
+        }
+      ]
+    }
+    ```
+
+    **要件定義ドキュメント:**
+    $requirements
+    """)
+
+def split_requirements(requirements_content: str, max_chars: int = REQUIREMENTS_CHUNK_CHARS) -> list:
+    """
+    要件定義ドキュメントをH1/H2見出し単位のセクションに分け、max_chars以内のチャンクにまとめる。
+    max_chars以下のドキュメントは分割せず、そのまま1チャンクとして返す。
+    """
+    if len(requirements_content) <= max_chars:
+        return [requirements_content]
+
+    # 見出し行の直前で分割する（見出し自体は各セクションの先頭に残る）
+    sections = re.split(r'(?m)^(?=#{1,2} )', requirements_content)
+
+    chunks = []
+    current_chunk = ""
+    for section in sections:
+        if current_chunk and len(current_chunk) + len(section) > max_chars:
+            chunks.append(current_chunk)
+            current_chunk = ""
+        current_chunk += section
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+def build_prompt(requirements_content: str) -> str:
+    """
+    要件定義ドキュメントからマイルストーンとタスクを抽出させるためのプロンプトを作成する。
+    """
+    return PROMPT_TEMPLATE.substitute(
+        today=datetime.now().strftime('%Y-%m-%d'),
+        requirements=requirements_content
+    )
+
+# --- LLM出力の検証 ---
+def optional_str_field(item: dict, field: str, default, item_label: str):
+    """
+    LLM出力の任意項目を文字列として取り出す。未設定または文字列でない場合は default を返す。
+    文字列でない値が入っていた場合は警告を出して未設定として扱う。
+    """
+    value = item.get(field)
+    if isinstance(value, str) and value:
+        return value
+    if value not in (None, ''):
+        logger.warning("Invalid %s %r for %s. Treating it as unset.", field, value, item_label)
+    return default
+
+def validate_llm_output(llm_output: dict) -> tuple:
+    """
+    call_gemini_api_batch でマージしたLLMの出力を一度にまとめて検証・正規化し、(マイルストーンのリスト, タスクのリスト) を返す。
+    GitHub上に何かを作成する前に不正なエントリを取り除くため、途中まで作成された状態で失敗することがない。
+    - マイルストーン: 文字列の `name` が必須。`target_repositories` はリストで、既知のリポジリのみ、重複を除いて残す。
+    - タスク: 文字列の `title` と既知の `target_repository` が必須。同じリポジリ・マイルストーン内で同名のタスクは最初の1件だけ残す。
+    - 任意項目 (`description`, `due_on`, `priority` など) は文字列でなければ未設定として扱う。
+    """
+    milestones = []
+    for m_data in llm_output['milestones']:
+        if not isinstance(m_data, dict) or not isinstance(m_data.get('name'), str) or not m_data['name']:
+            logger.warning("Skipping milestone creation due to missing name in LLM output.")
+            continue
+
+        raw_target_repositories = m_data.get('target_repositories') or []
+        if not isinstance(raw_target_repositories, list):
+            logger.warning("Invalid target_repositories for milestone '%s' (expected a list). Skipping.", m_data['name'])
+            continue
+
+        target_repositories = []
+        for repo_key in raw_target_repositories:
+            if not isinstance(repo_key, str):
+                logger.warning("Invalid target repository %r for milestone '%s'. Skipping.", repo_key, m_data['name'])
+            elif repo_key in target_repositories: # 順序を保ったまま重複を除く
+                continue
+            elif repo_key in REPO_MAP:
+                target_repositories.append(repo_key)
+            else:
+                logger.warning("Unknown target repository '%s' for milestone '%s'. Skipping.", repo_key, m_data['name'])
+        milestone_label = f"milestone '{m_data['name']}'"
+        milestones.append({
+            'name': m_data['name'],
+            'description': optional_str_field(m_data, 'description', "", milestone_label),
+            'due_on': optional_str_field(m_data, 'due_on', None, milestone_label),
+            'target_repositories': target_repositories,
+        })
+
+    tasks = []
+    seen_task_keys = set()
+    for task_data in llm_output['tasks']:
+        if not isinstance(task_data, dict) or not task_data.get('title') or not task_data.get('target_repository'):
+            logger.warning("Skipping task creation due to missing title or target_repository.")
+            continue
+        if not isinstance(task_data['title'], str) or not isinstance(task_data['target_repository'], str):
+            logger.warning("Skipping task creation due to non-string title or target_repository: %r", task_data['title'])
+            continue
+
+        task_title = task_data['title']
+        task_repo_key = task_data['target_repository']
+        if task_repo_key not in REPO_MAP:
+            logger.warning("Unknown target repository '%s' for task '%s'. Skipping.", task_repo_key, task_title)
+            continue
+
+        # マイルストーン名が文字列でない場合はマイルストーンなしとして扱う
+        task_milestone_name = task_data.get('milestone_name')
+        if task_milestone_name and not isinstance(task_milestone_name, str):
+            logger.warning("Invalid milestone_name %r for task '%s'. Creating it without a milestone.", task_milestone_name, task_title)
+            task_milestone_name = ''
+        task_milestone_name = task_milestone_name or ''
+
+        # 同じリポジリ・マイルストーンに同名のタスクが複数ある場合、並行実行で二重に作成されないよう最初の1件だけ残す
+        # (既存Issueの索引と同じく、マイルストーンが異なれば別のタスクとして扱う)
+        task_key = (task_repo_key, task_title, task_milestone_name)
+        if task_key in seen_task_keys:
+            logger.warning("Duplicate task '%s' for '%s' (milestone '%s') in LLM output. Skipping.", task_title, task_repo_key, task_milestone_name)
+            continue
+        seen_task_keys.add(task_key)
+
+        task_label = f"task '{task_title}'"
+        tasks.append(dict(
+            task_data,
+            milestone_name=task_milestone_name,
+            description=optional_str_field(task_data, 'description', '', task_label),
+            assignee_candidate=optional_str_field(task_data, 'assignee_candidate', 'unassigned', task_label),
+            priority=optional_str_field(task_data, 'priority', None, task_label),
+            task_granularity=optional_str_field(task_data, 'task_granularity', None, task_label),
+        ))
+
+    return milestones, tasks
 
 # --- GitHub操作関数 ---
 
 # 戻り値をintからMilestoneオブジェクトに変更
-def get_or_create_milestone(repo, milestone_data: dict) -> Optional['Milestone']: # ここを修正しました
+def get_or_create_milestone(repo, milestone_data: dict, existing_numbers_by_title: dict) -> Optional['Milestone']: # ここを修正しました
     """
     指定されたリポジリにマイルストーンが存在するか確認し、なければ作成する。
+    existing_numbers_by_title は fetch_existing_repo_items で取得した {タイトル: マイルストーン番号} の辞書で、
+    作成したマイルストーンも追加される。
     """
     milestone_name = milestone_data.get('name')
     milestone_description = milestone_data.get('description')
@@ -90,46 +581,54 @@ def get_or_create_milestone(repo, milestone_data: dict) -> Optional['Milestone']
     if milestone_description is None:
         milestone_description = ""
 
-    print(f"DEBUG: Attempting to get/create milestone. Name: '{milestone_name}', Due_on: '{milestone_due_on}' for repo: {repo.full_name}")
+    logger.debug("Attempting to get/create milestone. Name: '%s', Due_on: '%s' for repo: %s", milestone_name, milestone_due_on, repo.full_name)
 
     if not milestone_name:
-        print("Warning: Milestone name is missing. Skipping milestone creation.")
+        logger.warning("Milestone name is missing. Skipping milestone creation.")
         return None
 
-    existing_milestones = repo.get_milestones(state='all')
-    for m in existing_milestones:
-        if m.title == milestone_name:
-            print(f"Milestone '{milestone_name}' already exists in {repo.full_name} (ID: {m.id}).")
-            return m # 既存のMilestoneオブジェクトを返す
+    existing_number = existing_numbers_by_title.get(milestone_name)
+    if existing_number is not None:
+        try:
+            existing_milestone = repo.get_milestone(existing_number)
+        except GithubException as e:
+            logger.error("Error getting existing milestone '%s' in %s: %s", milestone_name, repo.full_name, e)
+            return None
+        logger.info("Milestone '%s' already exists in %s (ID: %s).", milestone_name, repo.full_name, existing_milestone.id)
+        return existing_milestone # 既存のMilestoneオブジェクトを返す
 
-    print(f"Creating new milestone '{milestone_name}' in {repo.full_name}...")
+    logger.info("Creating new milestone '%s' in %s...", milestone_name, repo.full_name)
 
     due_on_dt_or_notset = GithubObject.NotSet
     if milestone_due_on:
         try:
-            due_on_dt_or_notset = datetime.strptime(milestone_due_on, "%Y-%m-%d")
-            print(f"DEBUG: Parsed due_on date: {due_on_dt_or_notset}")
+            due_on_dt_or_notset = datetime.fromisoformat(milestone_due_on) # YYYY-MM-DD形式を想定
+            logger.debug("Parsed due_on date: %s", due_on_dt_or_notset)
         except ValueError:
-            print(f"Warning: Invalid date format for milestone '{milestone_name}' due_on: {milestone_due_on}. Skipping due_on.")
+            logger.warning("Invalid date format for milestone '%s' due_on: %s. Skipping due_on.", milestone_name, milestone_due_on)
             due_on_dt_or_notset = GithubObject.NotSet
 
     try:
-        new_milestone = repo.create_milestone(
-            title=milestone_name,
-            description=milestone_description,
-            due_on=due_on_dt_or_notset
-        )
-        print(f"Successfully created milestone '{milestone_name}' in {repo.full_name} (ID: {new_milestone.id}).")
-        time.sleep(2) # ここは念のため残しますが、後のロジックで再取得はしない
+        with github_write_semaphore:
+            new_milestone = repo.create_milestone(
+                title=milestone_name,
+                description=milestone_description,
+                due_on=due_on_dt_or_notset
+            )
+        logger.info("Successfully created milestone '%s' in %s (ID: %s).", milestone_name, repo.full_name, new_milestone.id)
+        existing_numbers_by_title[milestone_name] = new_milestone.number
         return new_milestone # 新しく作成したMilestoneオブジェクトを返す
     except GithubException as e:
-        print(f"Error creating milestone '{milestone_name}' in {repo.full_name}: {e}")
+        logger.error("Error creating milestone '%s' in %s: %s", milestone_name, repo.full_name, e)
         return None
 
 # milestone_idの代わりにmilestone_obj_for_issueを受け取るように変更
-def create_github_issue(repo, issue_data: dict, milestone_obj_for_issue: Optional['Milestone']): # ここを修正しました
+def create_github_issue(repo, issue_data: dict, milestone_obj_for_issue: Optional['Milestone'], existing_issues: dict) -> Optional[str]: # ここを修正しました
     """
     指定されたリポジリにIssueを作成し、マイルストーンやラベルを紐付ける。
+    作成したIssue、または同じマイルストーンに同名のIssueが既に存在する場合はそのIssueのノードIDを返す。
+    existing_issues は fetch_existing_repo_items で取得した {(タイトル, マイルストーンタイトル): ノードID} の辞書で、
+    作成したIssueも追加される。
     """
     title = issue_data.get('title')
     description = issue_data.get('description', '')
@@ -138,7 +637,7 @@ def create_github_issue(repo, issue_data: dict, milestone_obj_for_issue: Optiona
     task_granularity = issue_data.get('task_granularity') # タスク粒度も取得
 
     if not title:
-        print("Warning: Issue title is missing. Skipping issue creation.")
+        logger.warning("Issue title is missing. Skipping issue creation.")
         return
 
     # Issueに付与するラベルを準備
@@ -146,28 +645,19 @@ def create_github_issue(repo, issue_data: dict, milestone_obj_for_issue: Optiona
     if assignee_candidate != 'unassigned':
         labels_to_add.append(assignee_candidate) # ロール名をラベルとして追加
     if priority:
-        labels_to_add.append(f"priority:{priority}") # 優先順位をラベルとして追加 (例: "priority:high")
+        labels_to_add.append(PRIORITY_LABELS.get(priority) or f"priority:{priority}") # 優先順位をラベルとして追加 (例: "priority:high")
     if task_granularity: # タスク粒度もラベルとして追加
         labels_to_add.append(f"granularity:{task_granularity}")
 
 
-    # 既存のIssueを検索するためのマイルストーン引数を決定
-    # ここでは、milestone_obj_for_issueがMilestoneオブジェクトであればそれを使用
-    milestone_filter_arg = milestone_obj_for_issue if isinstance(milestone_obj_for_issue, Milestone) else 'none'
+    # 既存のIssueを検索 (簡易的な重複チェック、事前取得した (タイトル, マイルストーン) の索引を参照)
+    milestone_title = milestone_obj_for_issue.title if isinstance(milestone_obj_for_issue, Milestone) else ''
+    existing_issue_id = existing_issues.get((title, milestone_title))
+    if existing_issue_id:
+        logger.info("Issue '%s' already exists in %s. Skipping creation.", title, repo.full_name)
+        return existing_issue_id
 
-
-    # 既存のIssueを検索 (簡易的な重複チェック)
-    existing_issues = repo.get_issues(
-        state='open',
-        labels=labels_to_add, # 検索時にラベルも考慮
-        milestone=milestone_filter_arg # 正しくフォーマットされたマイルストーンフィルターを渡す
-    )
-    for issue in existing_issues:
-        if issue.title == title:
-            print(f"Issue '{title}' already exists in {repo.full_name} (ID: {issue.id}). Skipping creation.")
-            return
-
-    print(f"Creating issue '{title}' in {repo.full_name}...")
+    logger.info("Creating issue '%s' in %s...", title, repo.full_name)
 
     # Issue説明を決定: description が None または空文字列の場合、GithubObject.NotSet を渡す
     description_or_notset = GithubObject.NotSet
@@ -178,278 +668,311 @@ def create_github_issue(repo, issue_data: dict, milestone_obj_for_issue: Optiona
     # ここでは直接受け取ったmilestone_obj_for_issueを使用し、再取得はしない
     milestone_obj_for_creation = milestone_obj_for_issue if isinstance(milestone_obj_for_issue, Milestone) else GithubObject.NotSet
 
-    print(f"DEBUG: Creating issue '{title}' with milestone_obj: {milestone_obj_for_creation}")
+    logger.debug("Creating issue '%s' with milestone_obj: %s", title, milestone_obj_for_creation)
 
     try:
-        issue = repo.create_issue(
-            title=title,
-            body=description_or_notset,
-            labels=labels_to_add,
-            milestone=milestone_obj_for_creation # Milestoneオブジェクト、またはGithubObject.NotSet を渡す
-        )
-        print(f"Successfully created issue '{title}' in {repo.full_name} (Issue #{issue.number}).")
-        return issue
+        with github_write_semaphore:
+            issue = repo.create_issue(
+                title=title,
+                body=description_or_notset,
+                labels=labels_to_add,
+                milestone=milestone_obj_for_creation # Milestoneオブジェクト、またはGithubObject.NotSet を渡す
+            )
+        logger.info("Successfully created issue '%s' in %s (Issue #%s).", title, repo.full_name, issue.number)
+        existing_issues[(title, milestone_title)] = issue.node_id
+        return issue.node_id
     except GithubException as e:
-        print(f"Error creating issue '{title}' in {repo.full_name}: {e}")
+        logger.error("Error creating issue '%s' in %s: %s", title, repo.full_name, e)
         return None
 
-def add_issue_to_github_project(org_name: str, project_name: str, issue_obj: 'Issue'):
+def create_github_issue_after_milestone(repo, issue_data: dict, milestone_future, existing_issues: dict) -> Optional[str]:
     """
-    gh CLI を使用してIssueをGitHub Projectに追加する。
+    紐付け先のマイルストーンの作成/取得 (Future) の完了を待ってから create_github_issue を呼び出す。
+    milestone_future が None の場合はマイルストーンなしでIssueを作成する。
     """
-    print(f"Adding issue #{issue_obj.number} from {issue_obj.repository.full_name} to GitHub Project '{project_name}'...")
-    try:
-        # Step 1: プロジェクトIDと番号を取得する
-        # gh project list --owner <org_name> --format json
-        list_cmd = [
-            'gh', 'project', 'list',
-            '--owner', org_name,
-            '--format', 'json'
-        ]
-
-        print(f"DEBUG: Running gh project list command: {' '.join(list_cmd)}")
-        list_result = subprocess.run(list_cmd, capture_output=True, text=True, check=True)
-
-        print(f"DEBUG: gh project list stdout raw:\n{list_result.stdout}")
-        if list_result.stderr:
-            print(f"DEBUG: gh project list stderr raw:\n{list_result.stderr}")
-
-        if not list_result.stdout.strip():
-            print(f"Error: 'gh project list' returned empty stdout. No projects found or command output issue.")
-            sys.exit(1)
+    milestone_obj_for_issue = milestone_future.result() if milestone_future else None
+    return create_github_issue(repo, issue_data, milestone_obj_for_issue, existing_issues)
 
+def github_retry_wait_seconds(response, attempt: int) -> Optional[float]:
+    """
+    GitHub APIのレスポンスがリトライ対象なら待機秒数を返し、そうでなければNoneを返す。
+    403は認証やスコープの不足でも返るため、レート制限によるもの (Retry-After または残り回数0) の場合のみリトライする。
+    """
+    if response.status_code not in GITHUB_RETRY_STATUS_CODES:
+        return None
+    # Retry-Afterヘッダーがあればそれに従う
+    retry_after = response.headers.get('Retry-After')
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    if response.status_code == 403:
+        if response.headers.get('X-RateLimit-Remaining') != '0':
+            return None
+        # プライマリレート制限の場合はリセット時刻まで待つ
+        reset_at = response.headers.get('X-RateLimit-Reset')
+        if reset_at and reset_at.isdigit():
+            return max(int(reset_at) - time.time(), 1)
+    return GITHUB_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1))
+
+def call_github_graphql(query: str, variables: dict) -> dict:
+    """
+    GitHub GraphQL APIを呼び出し、レスポンスの`data`部分を返す。
+    レート制限 (403/429)、一時的なエラー (5xx)、タイムアウトや接続エラーの場合は待機してリトライし、
+    GraphQLのエラーやJSONでないレスポンスが返された場合はRuntimeErrorを送出する。
+    """
+    for attempt in range(1, GITHUB_MAX_RETRIES + 1):
         try:
-            raw_projects_output = json.loads(list_result.stdout)
-        except json.JSONDecodeError as e:
-            print(f"Error: Failed to parse JSON from 'gh project list' stdout: {e}")
-            print(f"  Problematic stdout content: {list_result.stdout[:500]}...")
-            sys.exit(1)
-
-        project_target_id = None
-        project_number = None
-
-        all_projects = raw_projects_output.get('projects', [])
+            response = http_session.post(
+                GITHUB_GRAPHQL_URL,
+                headers={'Authorization': f"Bearer {GITHUB_TOKEN}", 'Content-Type': 'application/json'},
+                data=orjson.dumps({'query': query, 'variables': variables}),
+                timeout=GITHUB_GRAPHQL_TIMEOUT
+            )
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            if attempt == GITHUB_MAX_RETRIES:
+                raise
+            wait_seconds = GITHUB_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1))
+            logger.warning("GitHub GraphQL API call failed (%s). Retrying in %ss...", e, wait_seconds)
+            time.sleep(wait_seconds)
+            continue
 
-        if not isinstance(all_projects, list):
-            print(f"Error: Expected 'projects' key in JSON output from 'gh project list' to be a list, but got: {type(all_projects)}. Full output:\n{list_result.stdout}")
-            sys.exit(1)
+        wait_seconds = github_retry_wait_seconds(response, attempt)
+        if wait_seconds is None or attempt == GITHUB_MAX_RETRIES:
+            break
+        logger.warning("GitHub GraphQL API returned %s. Retrying in %ss...", response.status_code, round(wait_seconds))
+        time.sleep(wait_seconds)
+    response.raise_for_status()
+    try:
+        result = orjson.loads(response.content)
+    except orjson.JSONDecodeError as e:
+        raise RuntimeError(f"GitHub GraphQL API returned a non-JSON response: {e}") from e
+    if result.get('errors'):
+        raise RuntimeError(f"GitHub GraphQL API returned errors: {result['errors']}")
+    return result['data']
+
+def fetch_existing_repo_items(repo_names: dict, project_id: str) -> tuple:
+    """
+    GraphQLで各リポジリの既存マイルストーンとオープンなIssueをまとめて取得する。
+    全リポジリ分を1リクエストで問い合わせ、100件を超える接続のみ続きのページを追加で取得する。
+    repo_names は {リポジリキー: リポジリ名} の辞書。
+    戻り値は ({リポジリキー: {マイルストーンタイトル: 番号}}, {リポジリキー: {(Issueタイトル, マイルストーンタイトル): IssueのノードID}},
+    project_id のProjectに追加済みのIssueのノードIDの集合)。
+    """
+    milestones_by_repo = {repo_key: {} for repo_key in repo_names}
+    issues_by_repo = {repo_key: {} for repo_key in repo_names}
+    linked_issue_ids = set()
+
+    # (リポジリキー, 接続名) -> 次ページのカーソル (最初のページはNone)
+    pending_cursors = {(repo_key, connection): None for repo_key in repo_names for connection in REPO_ITEM_CONNECTIONS}
+    while pending_cursors:
+        variable_defs = ['$owner: String!']
+        variables = {'owner': GITHUB_ORG_NAME}
+        repo_fields = []
+        for index, repo_key in enumerate(repo_names):
+            connection_fields = []
+            for connection, field_template in REPO_ITEM_CONNECTIONS.items():
+                if (repo_key, connection) not in pending_cursors:
+                    continue
+                cursor_var = f"c{index}_{connection}"
+                variable_defs.append(f"${cursor_var}: String")
+                variables[cursor_var] = pending_cursors[(repo_key, connection)]
+                connection_fields.append(field_template.format(cursor_var=cursor_var))
+            if not connection_fields:
+                continue
+            variable_defs.append(f"$r{index}: String!")
+            variables[f"r{index}"] = repo_names[repo_key]
+            repo_fields.append(f"r{index}: repository(owner: $owner, name: $r{index}) {{ {' '.join(connection_fields)} }}")
+
+        query = f"query({', '.join(variable_defs)}) {{ {' '.join(repo_fields)} }}"
+        data = call_github_graphql(query, variables)
+
+        next_cursors = {}
+        for index, repo_key in enumerate(repo_names):
+            repo_data = data.get(f"r{index}")
+            if not repo_data:
+                continue
+            for connection in REPO_ITEM_CONNECTIONS:
+                connection_data = repo_data.get(connection)
+                if connection_data is None:
+                    continue
+                for node in connection_data['nodes']:
+                    if connection == 'milestones':
+                        milestones_by_repo[repo_key][node['title']] = node['number']
+                    else:
+                        milestone_title = (node.get('milestone') or {}).get('title', '')
+                        issues_by_repo[repo_key][(node['title'], milestone_title)] = node['id']
+                        if any(item['project']['id'] == project_id for item in node['projectItems']['nodes']):
+                            linked_issue_ids.add(node['id'])
+                page_info = connection_data['pageInfo']
+                if page_info['hasNextPage']:
+                    next_cursors[(repo_key, connection)] = page_info['endCursor']
+        pending_cursors = next_cursors
+
+    for repo_key in repo_names:
+        logger.debug("Fetched %d milestones and %d open issues for '%s'.", len(milestones_by_repo[repo_key]), len(issues_by_repo[repo_key]), repo_key)
+    return milestones_by_repo, issues_by_repo, linked_issue_ids
+
+@functools.lru_cache(maxsize=None)
+def resolve_github_project_id(org_name: str, project_name: str) -> str:
+    """
+    GraphQLでOrganizationのGitHub Project (V2) を検索し、プロジェクトのノードIDを返す。
+    結果はキャッシュされるため、同じプロジェクトの検索は1回の実行で一度しか行われない。
+    """
+    query = """
+    query($org: String!, $name: String!) {
+      organization(login: $org) {
+        projectsV2(first: 20, query: $name) {
+          nodes { id title number }
+        }
+      }
+    }
+    """
+    try:
+        data = call_github_graphql(query, {'org': org_name, 'name': project_name})
+    except (requests.exceptions.RequestException, RuntimeError) as e:
+        logger.error("Error resolving GitHub Project '%s': %s", project_name, e)
+        sys.exit(1)
 
-        for p in all_projects:
-            print(f"DEBUG: Processing project object: {p}")
+    organization = data.get('organization') or {}
+    for p in (organization.get('projectsV2') or {}).get('nodes', []):
+        if p and p.get('title') == project_name:
+            logger.info("Found Project '%s' with ID: %s and Number: %s", project_name, p['id'], p['number'])
+            return p['id']
 
-            if not isinstance(p, dict):
-                print(f"Error: Expected project item to be a dictionary, but got {type(p)}. Content: {p}")
-                sys.exit(1)
+    logger.error("GitHub Project '%s' not found for owner '%s'. Please ensure the project exists and the PAT has sufficient permissions to list it.", project_name, org_name)
+    logger.error("Hint: You can check existing projects at: https://github.com/orgs/%s/projects", org_name)
+    sys.exit(1)
 
-            owner_login = p.get('owner', {}).get('login')
-            if owner_login == org_name and p.get('title') == project_name:
-                project_target_id = p.get('id')
-                project_number = p.get('number')
-                break
+def add_issues_to_github_project(project_id: str, project_name: str, issues: list):
+    """
+    GraphQLの`addProjectV2ItemById`ミューテーションでIssueをGitHub Projectに追加する。
+    issues は (Issueタイトル, IssueのノードID) のリスト。
+    エイリアスを付けたミューテーションを最大GITHUB_PROJECT_LINK_BATCH_SIZE件ずつ1リクエストにまとめて送る。
+    """
+    for batch_start in range(0, len(issues), GITHUB_PROJECT_LINK_BATCH_SIZE):
+        batch = issues[batch_start:batch_start + GITHUB_PROJECT_LINK_BATCH_SIZE]
+        for issue_title, _ in batch:
+            logger.info("Adding issue '%s' to GitHub Project '%s'...", issue_title, project_name)
+
+        variable_defs = ['$projectId: ID!']
+        variables = {'projectId': project_id}
+        mutation_fields = []
+        for index, (_, issue_id) in enumerate(batch):
+            variable_defs.append(f"$c{index}: ID!")
+            variables[f"c{index}"] = issue_id
+            mutation_fields.append(f"a{index}: addProjectV2ItemById(input: {{projectId: $projectId, contentId: $c{index}}}) {{ item {{ id }} }}")
+        mutation = f"mutation({', '.join(variable_defs)}) {{ {' '.join(mutation_fields)} }}"
 
-        if not project_target_id or not project_number:
-            print(f"Error: GitHub Project '{project_name}' not found for owner '{org_name}'. Please ensure the project exists and the PAT has sufficient permissions to list it.")
-            print(f"Hint: You can check existing projects by running: gh project list --owner {org_name} --web")
+        try:
+            with github_write_semaphore:
+                data = call_github_graphql(mutation, variables)
+            logger.debug("addProjectV2ItemById response: %s", data)
+            for issue_title, _ in batch:
+                logger.info("Successfully added issue '%s' to Project '%s'.", issue_title, project_name)
+        except (requests.exceptions.RequestException, RuntimeError) as e:
+            logger.error("Error adding issues to GitHub Project: %s", e)
+            sys.exit(1)
+        except Exception as e:
+            logger.error("An unexpected error occurred during Project linking: %s", e)
             sys.exit(1)
-
-        print(f"Found Project '{project_name}' with ID: {project_target_id} and Number: {project_number}")
-
-        # Step 2: Issueをプロジェクトに追加する
-        # gh project item-add <project-number> --url <issue-url> --owner <org-name>
-        cmd = [
-            'gh', 'project', 'item-add', str(project_number), # プロジェクト番号を文字列で渡す
-            '--url', issue_obj.html_url, # Issue URLを --url フラグで渡す
-            '--owner', org_name # --owner フラグをここに追加
-        ]
-
-        print(f"DEBUG: Running gh project item-add command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        print(f"DEBUG: gh project item-add stdout:\n{result.stdout}")
-        if result.stderr:
-            print(f"DEBUG: gh project item-add stderr:\n{result.stderr}")
-
-        print(f"Successfully added issue #{issue_obj.number} to Project '{project_name}'.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error adding issue to GitHub Project: {e}")
-        print(f"stdout: {e.stdout}")
-        print(f"stderr: {e.stderr}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"An unexpected error occurred during Project linking: {e}")
-        sys.exit(1)
 
 # --- メイン処理 ---
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python generate_project_items.py <requirements_file_path>")
+        logger.error("Usage: python generate_project_items.py <requirements_file_path>")
         sys.exit(1)
 
     requirements_file_path = sys.argv[1]
 
+    # 0. GitHub ProjectのノードIDを最初に一度だけ取得する
+    # (プロジェクトが見つからない場合、LLMを呼び出す前に終了できる)
+    project_id = resolve_github_project_id(GITHUB_ORG_NAME, GITHUB_PROJECT_NAME)
+
     # 1. 要件定義ファイルの読み込み
     try:
-        with open(requirements_file_path, 'r', encoding='utf-8') as f:
-            requirements_content = f.read()
-        print(f"Successfully read requirements from: {requirements_file_path}")
+        # バイト列として一度だけ読み込み、まとめてデコードする (BOM付きファイルにも対応)
+        requirements_content = Path(requirements_file_path).read_bytes().decode('utf-8-sig')
+        logger.info("Successfully read requirements from: %s", requirements_file_path)
     except FileNotFoundError:
-        print(f"Error: requirements file not found at {requirements_file_path}")
+        logger.error("requirements file not found at %s", requirements_file_path)
         sys.exit(1)
     except Exception as e:
-        print(f"Error reading requirements file: {e}")
+        logger.error("Error reading requirements file: %s", e)
         sys.exit(1)
 
-    # 2. LLMへのプロンプト作成
-    prompt = f"""
-    以下の要件定義ドキュメントから、主要なマイルストーン（目標）と、**それに付随する詳細なタスク（Issue）**をJSON形式で抽出してください。
-
-    - **マイルストーン**は以下のフィールドを持つものとします。
-      - `name`: マイルストーンのタイトル (文字列, 必須)
-      - `description`: マイルストーンの説明 (文字列, オプション)
-      - `target_repositories`: このマイルストーンが関連するリポジリのリスト (例: `["frontend", "backend"]`, **必ず1つ以上のリポジリを含めてください**)
-      - `due_on`: マイルストーンの期限 (YYYY-MM-DD形式の文字列, オプション, ただし、2025-06-13 ~ 2025-06-22の10-DAYハッカソンとする。 )
-
-    - **タスク**は以下のフィールドを持つものとします。
-      - `title`: Issueのタイトル (文字列, 必須)
-      - `description`: Issueの説明 (文字列, オプション)。**タスクの完了条件や影響範囲など、具体的で実行可能な内容を記述してください。**
-      - `target_repository`: このタスクが属するリポジリ ('frontend' または 'backend')
-      - `assignee_candidate`: 担当者候補 ('frontend' または 'backend')
-      - `priority`: タスクの優先順位 ('HIGH', 'MEDIUM', 'LOW' のいずれか, オプション)
-      - `milestone_name`: このタスクを紐付けるマイルストーンの`name` (文字列, **マイルストーンに紐づく場合は必ずそのマイルストーンの`name`と完全に一致させ、紐づかない場合は空文字列 `""` を指定してください**)
-      - `status`: タスクの進行状況 ('Todo' (デフォルト))
-
-    **要求事項:**
-    - マイルストーンを生成する場合、**必ずそのマイルストーンに関連する具体的なタスク（Issue）を複数生成してください。**
-    - タスクは、マイルストーンに紐づかない独立したものでも構いません。
-    - 生成するJSONは、指定されたフォーマットに厳密に従ってください。
-    - **マイルストーンに関連するタスクには、必ず該当するマイルストーンの`name`を`milestone_name`フィールドに正確に記述してください。**
-
-    **JSONフォーマット例:**
-    ```json
-    {{
-      "milestones": [
-        {{
-          "name": "GitHub OAuth 実装完了",
-          "description": "ユーザーがGitHubアカウントでログインし、Supabaseと連携できる状態",
-          "target_repositories": ["frontend", "backend"],
-          "due_on": "{datetime.now().strftime('%Y-%m-%d')}"
-        }}
-      ],
-      "tasks": [
-        {{
-          "title": "バックエンド: GitHub OAuth コールバック処理実装",
-          "description": "GitHubから受け取った認証コードをSupabaseに渡し、セッションを作成。完了条件：ユーザーセッションが正常に確立されること。参考：Supabase Auth ドキュメント。",
-          "target_repository": "backend",
-          "assignee_candidate": "backend",
-          "priority": "high",
-          "milestone_name": "GitHub OAuth 実装完了",
-          "status": "Todo"
-        }},
-        {{
-          "title": "フロントエンド: ログインUIと認証フロー実装",
-          "description": "ログインボタンからGitHub OAuth を呼び出し、認証後のリダイレクトを処理。完了条件：ログインボタンが表示され、クリックでGitHub認証が開始されること。",
-          "target_repository": "frontend",
-          "assignee_candidate": "frontend",
-          "priority": "high",
-          "milestone_name": "GitHub OAuth 実装完了",
-          "status": "Todo"
-        }},
-        {{
-          "title": "READMEを整備",
-          "description": "プロジェクトの基本的な情報、目的、コンセプトを記述する",
-          "target_repository": "frontend",
-          "assignee_candidate": "frontend",
-          "priority": "medium",
-          "milestone_name": "",
-          "status": "Todo"
-        }},
-        {{
-          "title": "バックエンド: 草データ取得API実装",
-          "description": "GitHub API を利用してユーザーのContributionデータを取得し、DBに保存するAPIを実装。影響範囲：デッキ編成画面、ユーザーデータ。",
-          "target_repository": "backend",
-          "assignee_candidate": "backend",
-          "priority": "medium",
-          "milestone_name": "",
-          "status": "Todo"
-        }}
-      ]
-    }}
-    ```
-
-    **要件定義ドキュメント:**
-    {requirements_content}
-    """
+    # 2. 要件定義の分割 (大きな要件定義は見出し単位で分割し、プロンプトはチャンクごとに作成する)
+    requirement_chunks = split_requirements(requirements_content)
 
-    # 3. LLM APIの呼び出し
-    llm_output = call_gemini_api(prompt)
+    # 3. LLM APIの呼び出し (チャンクごとに並行実行し、結果をマージ)
+    llm_output = call_gemini_api_batch(requirement_chunks)
 
-    milestones_data = llm_output.get('milestones', [])
-    tasks_data = llm_output.get('tasks', [])
+    # GitHubへの書き込みを始める前に、LLMの出力全体を一度に検証する
+    milestones_data, tasks_data = validate_llm_output(llm_output)
 
-    # 4. マイルストーンの作成/取得 (リポジリごとにIDを保持)
-    # ここではIDではなく、Milestoneオブジェクトそのものを格納する
-    # { "milestone_name": { "frontend": Milestone_Object, "backend": Milestone_Object } }
-    created_milestone_objects = {}
-
-    for m_data in milestones_data:
-        m_name = m_data.get('name')
-        if not m_name:
-            print("Warning: Skipping milestone creation due to missing name in LLM output.")
-            continue
+    # 既存のマイルストーンとIssueは全リポジリ分をGraphQLで一度に取得し、以降は辞書/集合で重複チェックする
+    try:
+        existing_milestones_by_repo, existing_issues_by_repo, linked_issue_ids = fetch_existing_repo_items(
+            REPO_NAMES,
+            project_id
+        )
+    except (requests.exceptions.RequestException, RuntimeError) as e:
+        logger.error("Error fetching existing milestones/issues: %s", e)
+        sys.exit(1)
 
-        created_milestone_objects[m_name] = {}
-        target_repos_for_milestone = m_data.get('target_repositories', [])
-
-        print(f"DEBUG: Milestone '{m_name}' target repositories: {target_repos_for_milestone}")
-
-        for repo_key in target_repos_for_milestone:
-            target_repo_obj = REPO_MAP.get(repo_key)
-            if target_repo_obj:
-                # Milestoneオブジェクトを受け取る
-                milestone_obj = get_or_create_milestone(target_repo_obj, m_data)
-                if milestone_obj:
-                    created_milestone_objects[m_name][repo_key] = milestone_obj
-                    print(f"DEBUG: Stored milestone object for '{m_name}' in '{repo_key}'. ID: {milestone_obj.id}")
-                else:
-                    print(f"Warning: Failed to get/create milestone '{m_name}' in {repo_key}. Associated issues might not be linked.")
+    # 4. マイルストーンの作成/取得とタスク (Issue) の作成
+    # milestone_futures には { (マイルストーン名, リポジリ): Milestoneオブジェクトを返すFuture } を格納する
+    # (マイルストーン, リポジリ) ごとの作成/取得と、タスク (Issue) の作成を同時に進める。
+    # 各タスクは自分が属するマイルストーンの Future だけを待つため、無関係なリポジリのマイルストーン作成を待たずに済む。
+    # タスクがマイルストーンの完了を待ってブロックしてもデッドロックしないよう、スレッドプールは別々に用意する。
+    milestone_futures = {}
+    issues_to_link = []
+    with ThreadPoolExecutor(max_workers=GITHUB_MAX_WORKERS) as milestone_executor, \
+            ThreadPoolExecutor(max_workers=GITHUB_MAX_WORKERS) as task_executor:
+        for m_data in milestones_data:
+            m_name = m_data['name']
+            logger.debug("Milestone '%s' target repositories: %s", m_name, m_data['target_repositories'])
+
+            for repo_key in m_data['target_repositories']:
+                milestone_futures[(m_name, repo_key)] = milestone_executor.submit(
+                    get_or_create_milestone, REPO_MAP[repo_key], m_data, existing_milestones_by_repo[repo_key]
+                )
+
+        # 5. タスク (Issue) の作成と紐付け (入力の検証と重複除去は validate_llm_output で済んでいる)
+        task_futures = []
+        for task_data in tasks_data:
+            task_repo_key = task_data['target_repository']
+            # 該当するマイルストーンの Future (存在しなければ None で、マイルストーンなしのIssueになる)
+            milestone_future = milestone_futures.get((task_data['milestone_name'], task_repo_key))
+            task_futures.append(task_executor.submit(
+                create_github_issue_after_milestone,
+                REPO_MAP[task_repo_key],
+                task_data,
+                milestone_future,
+                existing_issues_by_repo[task_repo_key]
+            ))
+
+        for (m_name, repo_key), future in milestone_futures.items():
+            # Milestoneオブジェクトを受け取る
+            milestone_obj = future.result()
+            if milestone_obj:
+                logger.debug("Stored milestone object for '%s' in '%s'. ID: %s", m_name, repo_key, milestone_obj.id)
             else:
-                print(f"Warning: Unknown target repository '{repo_key}' for milestone '{m_name}'. Skipping.")
-
-    print(f"DEBUG: Final created_milestone_objects: {created_milestone_objects}")
-
-    # 5. タスク (Issue) の作成と紐付け
-    for task_data in tasks_data:
-        task_title = task_data.get('title')
-        task_repo_key = task_data.get('target_repository')
-        task_milestone_name = task_data.get('milestone_name', '')
-
-        if not task_title or not task_repo_key:
-            print("Warning: Skipping task creation due to missing title or target_repository.")
-            continue
-
-        target_repo_obj = REPO_MAP.get(task_repo_key)
-        if not target_repo_obj:
-            print(f"Warning: Unknown target repository '{task_repo_key}' for task '{task_title}'. Skipping.")
-            continue
-
-        # 該当するマイルストーンオブジェクトを取得
-        milestone_obj_for_issue = None
-        if task_milestone_name and task_milestone_name in created_milestone_objects:
-            milestone_obj_for_issue = created_milestone_objects[task_milestone_name].get(task_repo_key)
-
-        # Issueを作成（直接Milestoneオブジェクトを渡す）
-        created_issue = create_github_issue(target_repo_obj, task_data, milestone_obj_for_issue)
+                logger.warning("Failed to get/create milestone '%s' in %s. Associated issues might not be linked.", m_name, repo_key)
+
+        for task_data, future in zip(tasks_data, task_futures):
+            issue_title = task_data['title']
+            issue_id = future.result() # ワーカー内の例外 (sys.exitを含む) をここで再送出する
+            if not issue_id:
+                logger.warning("Issue '%s' was not created or found. Skipping Project linking.", issue_title)
+            elif issue_id in linked_issue_ids:
+                logger.info("Issue '%s' is already in Project '%s'. Skipping Project linking.", issue_title, GITHUB_PROJECT_NAME)
+            else:
+                issues_to_link.append((issue_title, issue_id))
 
-        # Issueが正常に作成された場合、GitHub Projectに追加
-        if created_issue:
-            add_issue_to_github_project(
-                GITHUB_ORG_NAME,
-                GITHUB_PROJECT_NAME,
-                created_issue
-            )
-        else:
-            print(f"Warning: Issue '{task_title}' was not created or found. Skipping Project linking.")
+    # Projectに未追加のIssueだけをまとめてGitHub Projectに追加
+    if issues_to_link:
+        add_issues_to_github_project(project_id, GITHUB_PROJECT_NAME, issues_to_link)
 
-    print("\nAI-powered project item generation complete!")
+    logger.info("AI-powered project item generation complete!")
 
 if __name__ == "__main__":
     main()